@@ -1,21 +1,105 @@
 import os
 import time
-import json
 import re
+import functools
 from pathlib import Path
+import orjson
+import redis
 from dotenv import load_dotenv
 import google.generativeai as genai
 
-# Load environment variables from .env file
-env_path = Path(__file__).parent.parent / '.env'
-load_dotenv(dotenv_path=env_path)
+# Load environment variables from .env file (at most once per process,
+# even if the module gets imported under multiple names)
+if not os.getenv("_DOTENV_LOADED"):
+    env_path = Path(__file__).parent.parent / '.env'
+    load_dotenv(dotenv_path=env_path)
+    os.environ["_DOTENV_LOADED"] = "1"
 
 # Prompt version to use (v1 or v2)
 PROMPT_VERSION = os.getenv("PROMPT_VERSION", "v2")
 
+# Cache of Gemini analyses, keyed by "<sha256>:<prompt version>".
+# Stored in Redis when REDIS_URL is set (shared across uvicorn workers),
+# otherwise in a local JSON file under backend/.cache/.
+CACHE_DIR = Path(__file__).parent / ".cache"
+CACHE_FILE = CACHE_DIR / "analyses.json"
+CACHE_TTL = 30 * 24 * 3600  # 30 days
 
+# Markdown code-fence patterns, compiled once rather than per response
+_JSON_FENCE_OPEN = re.compile(r'^```(?:json)?\s*')
+_JSON_FENCE_CLOSE = re.compile(r'\s*```$')
+
+# Audio up to this size is attached inline to generate_content (one
+# round-trip); larger files go through the File API upload + poll path
+INLINE_UPLOAD_LIMIT = 18 * 1024 * 1024
+
+MIME_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".flac": "audio/flac",
+    ".ogg": "audio/ogg",
+    ".m4a": "audio/mp4",
+    ".aac": "audio/aac",
+}
+
+
+_redis = None
+
+
+def _get_redis():
+    """Return the shared Redis client, or None if REDIS_URL isn't set"""
+    global _redis
+    if _redis is None and os.getenv("REDIS_URL"):
+        _redis = redis.Redis.from_url(os.getenv("REDIS_URL"))
+    return _redis
+
+
+def _load_analysis_cache():
+    """Load the file-backed analysis cache (empty dict if missing/corrupt)"""
+    try:
+        return orjson.loads(CACHE_FILE.read_bytes())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return {}
+
+
+def _save_analysis_cache(cache):
+    """Write the file-backed analysis cache back to disk"""
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        CACHE_FILE.write_bytes(orjson.dumps(cache))
+    except OSError:
+        pass  # Cache is best-effort; never fail the request over it
+
+
+def cache_get(key):
+    """Look up a cached analysis (Redis if configured, else local file)"""
+    client = _get_redis()
+    if client is not None:
+        try:
+            value = client.get(key)
+            return orjson.loads(value) if value is not None else None
+        except redis.RedisError:
+            return None  # Treat an unreachable Redis as a cache miss
+    return _load_analysis_cache().get(key)
+
+
+def cache_set(key, value):
+    """Store an analysis (Redis with a 30-day TTL if configured, else local file)"""
+    client = _get_redis()
+    if client is not None:
+        try:
+            client.set(key, orjson.dumps(value), ex=CACHE_TTL)
+        except redis.RedisError:
+            pass  # Cache is best-effort; never fail the request over it
+        return
+    cache = _load_analysis_cache()
+    cache[key] = value
+    _save_analysis_cache(cache)
+
+
+@functools.lru_cache(maxsize=4)
 def load_prompt(version="v2"):
-    """Load prompt from file"""
+    """Load prompt from file (cached so we don't re-read per request)"""
     prompt_dir = Path(__file__).parent / "prompts"
     prompt_file = prompt_dir / f"suno_{version}.txt"
 
@@ -39,12 +123,38 @@ def configure_genai():
     genai.configure(api_key=api_key)
 
 
-def analyze_audio(audio_path):
+# Shared model instance, created once on first use. Re-configuring the
+# SDK and rebuilding GenerativeModel (and its HTTP client/TLS session)
+# per request is wasted work on the hot path. Kept lazy rather than
+# import-time so the module imports fine without an API key set.
+_model = None
+
+
+def get_model():
+    """Return the shared GenerativeModel, configuring the SDK on first use"""
+    global _model
+    if _model is None:
+        configure_genai()
+        _model = genai.GenerativeModel("gemini-2.0-flash")
+    return _model
+
+
+def analyze_audio(audio_path, content_hash=None, content=None):
     """
     Analyze audio using Google Gemini API.
 
+    Results are cached on disk by content hash + prompt version, so
+    re-uploading the same file skips the Gemini round-trip entirely.
+    Small files with their bytes in memory are sent inline in a single
+    generate_content call; only large files take the File API
+    upload/poll/delete path.
+
     Args:
         audio_path: Path to audio file
+        content_hash: Optional SHA-256 hex digest of the audio bytes,
+            used as the cache key
+        content: Optional raw audio bytes, attached inline when under
+            the File API threshold
 
     Returns:
         str: Suno-optimized music description
@@ -52,65 +162,86 @@ def analyze_audio(audio_path):
     if not os.path.exists(audio_path):
         return f"Error: File not found at {audio_path}"
 
+    # Check the cache before doing any network work
+    cache_key = f"{content_hash}:{PROMPT_VERSION}" if content_hash else None
+    if cache_key:
+        cached = cache_get(cache_key)
+        if cached is not None:
+            print(f"Cache hit for {os.path.basename(audio_path)}, skipping Gemini.")
+            return cached
+
     try:
-        configure_genai()
+        # Reuses the shared SDK configuration + model across requests
+        model = get_model()
 
-        print(f"Uploading {os.path.basename(audio_path)} to Gemini...")
+        # Load the Suno-Optimized Prompt
+        prompt = load_prompt(PROMPT_VERSION)
 
-        # 1. Upload the file to Google's temporary storage
-        audio_file = genai.upload_file(audio_path)
+        if content is not None and len(content) <= INLINE_UPLOAD_LIMIT:
+            # Fast path: attach the bytes inline, collapsing the
+            # upload / poll / generate / delete sequence to one request
+            print(f"Analyzing {os.path.basename(audio_path)} (inline)...")
 
-        # 2. Wait for processing (usually instant for MP3s, but good practice)
-        while audio_file.state.name == "PROCESSING":
-            time.sleep(1)
-            audio_file = genai.get_file(audio_file.name)
+            mime_type = MIME_TYPES.get(Path(audio_path).suffix.lower(), "audio/mpeg")
+            response = model.generate_content(
+                [prompt, {"mime_type": mime_type, "data": content}]
+            )
+        else:
+            print(f"Uploading {os.path.basename(audio_path)} to Gemini...")
 
-        if audio_file.state.name == "FAILED":
-            return "Error: Google failed to process the audio file."
+            # 1. Upload the file to Google's temporary storage
+            audio_file = genai.upload_file(audio_path)
 
-        print("Analyzing Vibe...")
+            # 2. Wait for processing. Files are usually ACTIVE immediately, so
+            # poll with exponential backoff (50 ms -> 500 ms cap) instead of a
+            # fixed 1 s sleep that puts a whole-second floor on every request.
+            delay = 0.05
+            while audio_file.state.name == "PROCESSING":
+                time.sleep(delay)
+                delay = min(delay * 1.6, 0.5)
+                audio_file = genai.get_file(audio_file.name)
 
-        # 3. Initialize the Vibe Reader (Gemini 2.0 Flash is fastest/cheapest)
-        model = genai.GenerativeModel("gemini-2.0-flash")
+            if audio_file.state.name == "FAILED":
+                return "Error: Google failed to process the audio file."
 
-        # 4. Load the Suno-Optimized Prompt
-        prompt = load_prompt(PROMPT_VERSION)
+            print("Analyzing Vibe...")
 
-        # 5. Generate
-        response = model.generate_content([prompt, audio_file])
+            # 3. Generate
+            response = model.generate_content([prompt, audio_file])
 
-        # Cleanup: Delete the file from cloud storage to keep it clean
-        audio_file.delete()
+            # Cleanup: Delete the file from cloud storage to keep it clean
+            audio_file.delete()
 
         # Parse JSON response
         response_text = response.text.strip()
 
         # Remove markdown code blocks if present
-        response_text = re.sub(r'^```json\s*', '', response_text)
-        response_text = re.sub(r'\s*```$', '', response_text)
+        response_text = _JSON_FENCE_OPEN.sub('', response_text)
+        response_text = _JSON_FENCE_CLOSE.sub('', response_text)
 
         # Try to parse JSON
         try:
-            analysis_data = json.loads(response_text)
+            analysis_data = orjson.loads(response_text)
 
-            # Normalize v3 format to match v1/v2 structure for backward compatibility
+            # Normalize v3 format to match v1/v2 structure for backward
+            # compatibility, mutating in place instead of rebuilding the dict
             if PROMPT_VERSION == "v3" and "style_of_music" in analysis_data:
-                # v3 has different structure, create a compatible wrapper
-                return {
-                    "genre": analysis_data.get("style_of_music", ""),
-                    "mood": analysis_data.get("mood", ""),  # v3 now includes mood field
-                    "instrumentation": "",  # In sections
-                    "production": "",  # In sections
-                    "tempo_descriptor": "",  # In style_of_music
-                    "vocal_style": "",  # In sections
-                    "structure_tags": "",
-                    "prompt": analysis_data.get("combined_prompt", ""),
-                    "sections": analysis_data.get("sections", []),  # v3 specific
-                    "style_of_music": analysis_data.get("style_of_music", "")  # v3 specific
-                }
+                analysis_data["genre"] = analysis_data.get("style_of_music", "")
+                analysis_data.setdefault("mood", "")  # v3 now includes mood field
+                analysis_data.setdefault("instrumentation", "")  # In sections
+                analysis_data.setdefault("production", "")  # In sections
+                analysis_data.setdefault("tempo_descriptor", "")  # In style_of_music
+                analysis_data.setdefault("vocal_style", "")  # In sections
+                analysis_data.setdefault("structure_tags", "")
+                analysis_data["prompt"] = analysis_data.pop("combined_prompt", "")
+                analysis_data.setdefault("sections", [])  # v3 specific
+
+            # Store successful analyses so identical uploads hit the cache
+            if cache_key:
+                cache_set(cache_key, analysis_data)
 
             return analysis_data
-        except json.JSONDecodeError as json_err:
+        except orjson.JSONDecodeError as json_err:
             # If JSON parsing fails, return raw text wrapped in dict
             print(f"Warning: Could not parse JSON response: {json_err}")
             return {
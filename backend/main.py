@@ -4,17 +4,21 @@ AudioMood FastAPI Backend
 HTTP API for audio feature extraction and analysis.
 """
 
+import asyncio
+import hashlib
 import os
 import tempfile
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
+from .audio_llm import PROMPT_VERSION, cache_get
 from .features import extract_features
 
 
@@ -25,8 +29,14 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Initialize rate limiter (8 requests per day per IP)
-limiter = Limiter(key_func=get_remote_address)
+# Initialize rate limiter (8 analyses per day per IP). With multiple
+# uvicorn workers the default in-memory backend keeps per-process
+# counters (N workers = N x the limit), so point REDIS_URL at a shared
+# Redis instance to enforce the limit across workers.
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=os.getenv("REDIS_URL", "memory://")
+)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
@@ -43,6 +53,10 @@ app.add_middleware(
 ALLOWED_EXTENSIONS = {".mp3", ".wav", ".flac", ".ogg", ".m4a", ".aac"}
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
 
+# Batch endpoint limits
+MAX_BATCH_FILES = 8
+BATCH_CONCURRENCY = asyncio.Semaphore(8)  # Cap concurrent Gemini calls
+
 
 @app.get("/health")
 def health_check() -> Dict[str, str]:
@@ -55,60 +69,37 @@ def health_check() -> Dict[str, str]:
     return {"status": "ok"}
 
 
-@app.post("/api/analyze")
-@limiter.limit("8/day")
-async def analyze_audio(request: Request, file: UploadFile = File(...)) -> Dict[str, Any]:
+def _process_upload(content: bytes, file_ext: str, content_hash: str = None) -> Dict[str, Any]:
     """
-    Analyze an audio file and extract features.
+    Run the analysis pipeline on one upload's bytes.
 
-    Rate limit: 8 requests per day per IP address.
+    Stages the content to a temporary file (for the Gemini upload and
+    decode fallback), extracts features, and cleans up.
 
     Args:
-        request: FastAPI request object (for rate limiting)
-        file: Uploaded audio file (MP3, WAV, FLAC, etc.)
+        content: Raw file bytes
+        file_ext: File extension including the dot (e.g. ".mp3")
+        content_hash: Optional precomputed SHA-256 hex digest of content
 
     Returns:
         Dictionary with tempo, key, mode, energy, and AI analysis
 
     Raises:
-        HTTPException: If file validation fails or processing error occurs
-        RateLimitExceeded: If rate limit (8/day) is exceeded
+        HTTPException: If processing fails
     """
-    # Validate file extension
-    file_ext = Path(file.filename).suffix.lower()
-    if file_ext not in ALLOWED_EXTENSIONS:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
-        )
-
-    # Read file content
-    try:
-        content = await file.read()
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to read file: {str(e)}"
-        )
-
-    # Validate file size
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File too large. Max size: {MAX_FILE_SIZE / (1024 * 1024)} MB"
-        )
+    # Hash the content so identical uploads hit the analysis cache
+    if content_hash is None:
+        content_hash = hashlib.sha256(content).hexdigest()
 
-    # Save to temporary file
     temp_file = None
     try:
         with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
             tmp.write(content)
             temp_file = tmp.name
 
-        # Extract features
-        result = extract_features(temp_file)
-
-        return result
+        # Extract features (decoding straight from the in-memory bytes;
+        # the tempfile only backs the Gemini upload and decode fallback)
+        return extract_features(temp_file, content_hash=content_hash, content=content)
 
     except Exception as e:
         raise HTTPException(
@@ -125,6 +116,205 @@ async def analyze_audio(request: Request, file: UploadFile = File(...)) -> Dict[
                 pass  # Ignore cleanup errors
 
 
+def _validate_extension(filename: str) -> str:
+    """
+    Validate an upload's file extension.
+
+    Args:
+        filename: Original filename from the client
+
+    Returns:
+        The lowercased file extension (including the dot)
+
+    Raises:
+        HTTPException: If the extension is not an allowed audio type
+    """
+    file_ext = Path(filename).suffix.lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
+        )
+
+    return file_ext
+
+
+def _check_content_length(request: Request, limit: int) -> None:
+    """
+    Reject a request from its Content-Length header before reading the body.
+
+    Args:
+        request: Incoming request
+        limit: Maximum allowed body size in bytes
+
+    Raises:
+        HTTPException: If the declared body size exceeds the limit
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Request body too large. Max size: {limit / (1024 * 1024)} MB"
+        )
+
+
+async def _read_upload(file: UploadFile) -> bytes:
+    """
+    Read an upload in chunks, aborting as soon as it exceeds MAX_FILE_SIZE.
+
+    Avoids buffering an arbitrarily large body in memory before the size
+    check: an oversized upload is rejected after at most one chunk past
+    the limit.
+
+    Args:
+        file: Uploaded file
+
+    Returns:
+        The raw file bytes
+
+    Raises:
+        HTTPException: If the upload is too large or can't be read
+    """
+    chunks = []
+    size = 0
+    try:
+        while chunk := await file.read(1 << 20):
+            size += len(chunk)
+            if size > MAX_FILE_SIZE:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File too large. Max size: {MAX_FILE_SIZE / (1024 * 1024)} MB"
+                )
+            chunks.append(chunk)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to read file: {str(e)}"
+        )
+
+    return b"".join(chunks)
+
+
+@app.post("/api/analyze")
+@limiter.shared_limit("8/day", scope="analyze")
+async def analyze_audio(request: Request, file: Optional[UploadFile] = File(None)) -> Response:
+    """
+    Analyze an audio file and extract features.
+
+    Responses carry an ETag (the SHA-256 of the file bytes). A client
+    that already knows its file's hash can send it as If-None-Match —
+    with or without the file attached — and gets a 304 back if the
+    analysis is still cached, skipping the upload and all processing.
+
+    Rate limit: 8 analyses per day per IP address, drawn from a budget
+    shared with the batch endpoint.
+
+    Args:
+        request: FastAPI request object (for rate limiting and ETag headers)
+        file: Uploaded audio file (MP3, WAV, FLAC, etc.); may be omitted
+            when revalidating with If-None-Match
+
+    Returns:
+        JSON with tempo, key, mode, energy, and AI analysis (or 304)
+
+    Raises:
+        HTTPException: If file validation fails or processing error occurs
+        RateLimitExceeded: If rate limit (8/day) is exceeded
+    """
+    # ETag revalidation: reply 304 from the analysis cache before
+    # touching the multipart body at all
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        etag = if_none_match.strip().removeprefix("W/").strip('"')
+        if cache_get(f"{etag}:{PROMPT_VERSION}") is not None:
+            return Response(
+                status_code=304,
+                headers={
+                    "ETag": f'"{etag}"',
+                    "Cache-Control": "private, max-age=2592000",
+                },
+            )
+
+    if file is None:
+        raise HTTPException(status_code=400, detail="No file provided.")
+
+    # Cheap rejections first: declared size, then extension
+    _check_content_length(request, MAX_FILE_SIZE)
+    file_ext = _validate_extension(file.filename)
+
+    content = await _read_upload(file)
+    content_hash = hashlib.sha256(content).hexdigest()
+
+    # Run the CPU-bound pipeline in a worker thread so the event loop
+    # keeps serving other requests instead of blocking on librosa
+    result = await asyncio.to_thread(_process_upload, content, file_ext, content_hash)
+
+    # Only mark the response cacheable when the analysis succeeded;
+    # Gemini failures and the silence/too-short canned result are never
+    # stored server-side, so clients must not treat them as fresh either
+    analysis = result.get("analysis")
+    headers = {}
+    if isinstance(analysis, dict) and "error" not in analysis:
+        headers = {
+            "ETag": f'"{content_hash}"',
+            "Cache-Control": "private, max-age=2592000",
+        }
+
+    return JSONResponse(content=result, headers=headers)
+
+
+@app.post("/api/analyze/batch")
+@limiter.shared_limit("8/day", scope="analyze", cost=MAX_BATCH_FILES)
+async def analyze_audio_batch(request: Request, files: List[UploadFile] = File(...)) -> List[Dict[str, Any]]:
+    """
+    Analyze several audio files in one request.
+
+    Files are processed concurrently (Gemini uploads overlap), capped at
+    8 in flight at a time. Failures are reported per file instead of
+    failing the whole batch.
+
+    Rate limit: shared 8-analyses-per-day budget per IP address with the
+    single-file endpoint. The limit is enforced before the multipart body
+    is parsed, so a batch is charged its worst case (MAX_BATCH_FILES)
+    regardless of how many files it actually carries.
+
+    Args:
+        request: FastAPI request object (for rate limiting)
+        files: Uploaded audio files (MP3, WAV, FLAC, etc.)
+
+    Returns:
+        List of per-file results, each with "filename" plus either the
+        analysis fields or an "error" message
+
+    Raises:
+        HTTPException: If the batch itself is invalid (empty or too large)
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="No files provided.")
+
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files. Max per batch: {MAX_BATCH_FILES}"
+        )
+
+    _check_content_length(request, MAX_BATCH_FILES * MAX_FILE_SIZE)
+
+    async def analyze_one(file: UploadFile) -> Dict[str, Any]:
+        try:
+            file_ext = _validate_extension(file.filename)
+            content = await _read_upload(file)
+            async with BATCH_CONCURRENCY:
+                result = await asyncio.to_thread(_process_upload, content, file_ext)
+            return {"filename": file.filename, **result}
+        except HTTPException as e:
+            return {"filename": file.filename, "error": e.detail}
+
+    return list(await asyncio.gather(*(analyze_one(f) for f in files)))
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)